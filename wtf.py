@@ -5,106 +5,174 @@
 
 
 import random
+import re
+from array import array
 random.seed(0)
 
 # Error handling (brutal)
 _ERRNO = 0
 
-def exit_on(cond, msg):
-    if cond:
-        if _NLINE > 0:
-            print(f"{_NAME}:{_NLINE}: WTF! ", end="")
-        elif _IP >= 0:
-            print(f"CODE_DUMP:{_IP-2}: WTF! ", end="")
-        print(msg, "sorry, this is a fatal error!")
-        exit(-1)
+# The checked conditions are false >99% of the time, so they are
+# tested inline at each call site (if cond: fatal(msg)) and only the
+# reporting branch pays for a function call.
 
-def error_on(cond, msg):
+def fatal(msg):
+    # report and die: never returns
+    if _NLINE > 0:
+        print(f"{_NAME}:{_NLINE}: WTF! ", end="")
+    elif _vm.ip >= 0:
+        print(f"CODE_DUMP:{_vm.ip-1}: WTF! ", end="")
+    print(msg, "sorry, this is a fatal error!")
+    exit(-1)
+
+def compile_error(msg):
+    # report a compile-time error and keep going, up to a limit
     global _ERRNO
-    if cond:
-        if _NLINE > 0:
-            print(f"{_NAME}:{_NLINE}: WTF! ", end="")
-        elif _IP >= 0:
-            print(f"CODE_DUMP:{_IP-2}: WTF! ", end="")
-        print(msg)
-        _ERRNO += 1
-        exit_on(_ERRNO >= 100, f"That makes {_ERRNO} errors: I give up!")
+    if _NLINE > 0:
+        print(f"{_NAME}:{_NLINE}: WTF! ", end="")
+    elif _vm.ip >= 0:
+        print(f"CODE_DUMP:{_vm.ip-1}: WTF! ", end="")
+    print(msg)
+    _ERRNO += 1
+    if _ERRNO >= 100:
+        fatal(f"That makes {_ERRNO} errors: I give up!")
+
+class _Code:
+    """Compiled code: the opcodes are packed into an int16 array with
+    the arguments in a parallel list, instead of a list of (op, arg)
+    pairs. The pair tuples were the bulk of the code memory; packing
+    the opcodes also keeps the dispatch loop's reads close together.
+    The arguments stay in one plain list because most of them are
+    jump addresses, slot indexes or code references that the dispatch
+    loop needs as Python objects anyway."""
+    __slots__ = ("ops", "args")
+    def __init__(self):
+        self.ops = array("h")
+        self.args = []
+    def __len__(self):
+        return len(self.ops)
+    def append(self, r, v):
+        self.ops.append(r)
+        self.args.append(v)
 
 # Builtin stacks
-_CSTK = []  # compiled code is pushed here
-_DSTK = []  # temporary data, both at compile-time and at run-time
-_PSTK = []  # used at compile-time to keep track of control structures nesting
-_VSTK = []  # variables values are pushed here
+_CSTK = _Code()     # compiled code is pushed here
+_DSTK = []  # compile-time temporary data (pending word triples)
+_PSTK = []  # used at compile-time to keep track of control structures
+            # nesting: each entry is a single (payload, sentinel) tuple
+
+# Variables: numeric values live unboxed in an array('d') while stacks,
+# files and other objects live in a parallel list; the byte in _VTAG
+# tells which side currently holds slot i. A DEF slot starts numeric
+# but assignments may retag it: procedure parameters receive stacks
+# too. Call frames, which used to share the variable stack, live on
+# the VM return stack instead.
+_VNUM = array("d")
+_VOBJ = []
+_VTAG = bytearray()
 
 # Stacks are implemented as lists.
 def push(stk, elem):
     stk.append(elem)
 
 def pop(stk):
-    exit_on(len(stk) == 0, "Missing value (stack underflow)")
+    if not stk:
+        fatal("Missing value (stack underflow)")
     return stk.pop()
 
+# Size of the preallocated run-time data stack.
+_DS_SIZE = 4096
+
+# Run-time state of the interpreter: attribute access on a __slots__
+# instance is faster than the LOAD_GLOBAL/STORE_GLOBAL pairs the
+# primitives used to perform on module-level variables. The data stack
+# is a preallocated list indexed by the stack pointer dsp, so that the
+# primitives can replace the topmost items in place instead of paying
+# a pop/append pair per operation.
+class _VM:
+    __slots__ = ("ip", "cstk", "ds", "dsp", "vnum", "vobj", "vtag",
+                 "rstk")
+    def __init__(self):
+        self.ip = -1        # index in cstk of the next instruction
+        self.cstk = _CSTK
+        self.ds = [None] * _DS_SIZE
+        self.dsp = 0        # index in ds of the first free slot
+        self.vnum = _VNUM
+        self.vobj = _VOBJ
+        self.vtag = _VTAG
+        self.rstk = []      # call frames: saved (code, ip) pairs
+
+_vm = _VM()
+
+def underflow():
+    fatal("Missing value (stack underflow)")
+
+def overflow():
+    fatal("Too many values (stack overflow)")
+
 
 #       Compile time stuff
 
 # Lexical analyzer
 
-# _CCODES[c] = -1, 0, 1 whether the ASCII character of code c is a
-# word-character, a space character or a "letter" (part of a word).
-_CCODES = [0]*33 + [1]*223  # A priori each printable is letter
-_CCODES[ord("\n")] = -1
-_CCODES[ord("\"")] = -1
-_CCODES[ord("(")] = -1
-_CCODES[ord(")")] = -1
-_CCODES[ord("\\")] = -1
-_CCODES[ord("[")] = -1
-_CCODES[ord("]")] = -1
+# A single compiled regex recognizes every kind of token, so that the
+# whole scan happens in C: group 1 is a newline, group 2 the optional
+# newline ending a comment (the comment itself is not captured), group
+# 3 a double-quoted string (possibly unterminated at end of file) and
+# group 4 a word, i.e. a maximal run of "letters" (anything but spaces,
+# quotes, brackets and backslash) or a single bracket character.
+# The character class in group 4 doubles as the delimiter table: the
+# delimiters need no separate classification pass because any of them
+# ends the run, so each token comes out of the regex already split
+# and classified by the group that matched it.
+_TOK_RE = re.compile(
+    r'(\n)|\\[^\n]*(\n?)|("[^"]*"?)|([^\x00-\x20"()\\\[\]]+|[()\[\]])')
 
-# Last character parsed, if any
-_CLAST = ''
+# The source under compilation, slurped in a single read, and the
+# iterator over its token matches.
+_BUF = ""
+_TOKENS = iter(())
 
 # Current source line under parsing (>= 1)
 _NLINE = 0
 
-def scan_char():
-    """Scans a character from the _SRC file and returns it: if
-    _CLAST != "" then it is returned as value and set to ""."""
-    global _CLAST
-    # The next character could have been already scanned
-    # and in this case _CLAST contains it.
-    if _CLAST != "":
-        c = _CLAST
-        _CLAST = ""
-    else:
-        c = _SRC.read(1)
-    return c
-
 def scan_word():
-    """Scan a word from file _SRC and return it. A word is any sequence
-    of consecutive non space character, or it is a single character
-    marked with -1 in the CCODES[] table. Since the character following
-    the word is also parsed, it is stored into _CLAST and used on the
-    next call of scan_char()."""
-    global _CLAST
-    while (w := scan_char()) != '' and _CCODES[ord(w)] != -1:
-        if _CCODES[ord(w)] == 1:
-            while (c := scan_char()) != '' and _CCODES[ord(c)] == 1:
-                w += c
-            _CLAST = c
-            break
-    return w
+    """Scan a token from the source buffer and return it: a word, a
+    newline, or a whole string literal (quotes included); comments are
+    skipped here. "" is returned when the buffer is ended."""
+    global _NLINE
+    for m in _TOKENS:
+        k = m.lastindex
+        if k == 4 or k == 3:
+            return m.group()
+        if k == 1:
+            return "\n"
+        # a comment: skip it, counting the newline that closes it, so
+        # that it does not reach the NEWLINE word (a comment continues
+        # the logical line, see compile_words in NEWLINE).
+        if m.group(2) != "":
+            _NLINE += 1
+    return ""
 
 # Source compilation
 
 def compile_words(n):
     """Pop words (stored as triples (p,r,v)) from _DSTK with
-    priorities >= n and compile them to _CSTK."""
-    while len(_DSTK) >= 3 and _DSTK[-1] >= n:
-        p = pop(_DSTK)
-        r = pop(_DSTK)
-        v = pop(_DSTK)
-        push(_CSTK, r)
-        push(_CSTK, v)
+    priorities >= n and compile them to _CSTK, without crossing the
+    innermost open parenthesis. The stacks are bound to locals and
+    popped/appended directly: this loop runs for every operator
+    compiled, so the push/pop wrappers are not worth their call
+    overhead here."""
+    d = _DSTK
+    base = _PAREN_STK[-1][1] if _PAREN_STK else 0
+    ops = _CSTK.ops
+    args = _CSTK.args
+    while len(d) >= base + 3 and d[-1] >= n:
+        p = d.pop()
+        r = d.pop()
+        v = d.pop()
+        ops.append(r)
+        args.append(v)
 
 def compile(p, r, v):
     """Push the pair (r,v) on _DSTK or _CSTK according to the value
@@ -113,185 +181,563 @@ def compile(p, r, v):
     if p == 0:
         r(v)
     elif p == 255:
-        push(_CSTK, r)
-        push(_CSTK, v)
+        _CSTK.append(r, v)
     else:
         compile_words(p)
-        push(_DSTK, v)
-        push(_DSTK, r)
-        push(_DSTK, p)
+        d = _DSTK
+        d.append(v)
+        d.append(r)
+        d.append(p)
+
+# Inline cache over the dictionary: memoizes the resolution (or the
+# proven absence, stored as False) of each word, so the common case
+# costs a single hashed lookup instead of a user-then-builtin probe,
+# and number literals skip the double miss. Definitions and scope
+# switches are rare next to the tokens compiled between them, so they
+# just invalidate the whole cache.
+_RESOLVED = {}
 
 def find_word(w):
-    """Look for w inside the dictionary: being the latter a stack,
-    it is scanned from its topmost element downward. If w is found,
-    the index in _DICT of the word (which starts a quadruple (w,p,r,v))
-    is returned, else a negative number is returned."""
-    for i in range(len(_DICT) - 4, -1, -4):
-        if _DICT[i] == w:
-            return i
-    return -1
+    """Look for w inside the dictionary and return its triple (p,r,v)
+    of priority, routine and value; None is returned if the word is
+    not defined. User definitions shadow builtin ones."""
+    t = _RESOLVED.get(w)
+    if t is not None:
+        return t if t is not False else None
+    t = _USER.get(w) or _BUILTINS.get(w)
+    _RESOLVED[w] = t if t is not None else False
+    return t
+
+# Memo for number parsing: maps a token to its float value, or to None
+# if the token is known not to be a number; probing via float() inside
+# try/except is expensive and the same literal is paid for only once.
+_NUM_CACHE = {}
+_NOT_CACHED = object()
+# Characters a float literal may start with (digits, sign, dot and the
+# initials of "inf"/"nan"): anything else cannot be a number at all.
+_NUM_START = frozenset("0123456789+-.inIN")
 
 def compile_file():
-    """Compile words from file _SRC until the file is ended."""
-    global _NLINE
+    """Compile words from the source buffer _BUF until it is ended.
+    The loop walks the regex matches directly and resolves each word
+    at the match site, so a token costs no scan_word call and at most
+    one dictionary probe; the group that matched already classifies
+    the token. Defining words executed from compile() still pull
+    their operands through scan_word, which shares the iterator."""
+    global _NLINE, _TOKENS
     _NLINE = 1
-    while (w := scan_word()) != "":
-        if (i := find_word(w)) >= 0:
-            compile(_DICT[i+1], _DICT[i+2], _DICT[i+3])
-        else:
-            try:    # probe a number, the dirty way
-                compile(255, PUSH, float(w))
-            except ValueError:
-                error_on(True, f"Unknown word {w}")
+    _TOKENS = _TOK_RE.finditer(_BUF)
+    resolved = _RESOLVED
+    ncache = _NUM_CACHE
+    # the newline word is resolved once here: its name is a token
+    # delimiter, so no program can scan it as a definition name
+    nl_p, nl_r, nl_v = _BUILTINS["\n"]
+    for m in _TOKENS:
+        k = m.lastindex
+        if k == 4:          # a word: resolve it right here
+            w = m.group()
+            t = resolved.get(w)
+            if t is None:
+                t = _USER.get(w) or _BUILTINS.get(w)
+                resolved[w] = t if t is not None else False
+            if t:
+                compile(t[0], t[1], t[2])
+                continue
+            # not in the dictionary: probe the number memo
+            num = ncache.get(w, _NOT_CACHED)
+            if num is _NOT_CACHED:
+                num = None
+                if w[0] in _NUM_START:
+                    try:    # probe a number, the dirty way
+                        num = float(w)
+                    except ValueError:
+                        pass
+                ncache[w] = num
+            if num is not None:
+                compile(255, OP_PUSH, num)
+            else:
+                compile_error(f"Unknown word {w}")
+        elif k == 3:
+            # a whole string literal scanned by the tokenizer
+            w = m.group()
+            if len(w) < 2 or w[-1] != '"':
+                fatal("End of file inside string")
+            compile(255, OP_PUSH, w[1:-1])
+        elif k == 1:        # a newline: pre-resolved handler
+            compile(nl_p, nl_r, nl_v)
+        elif m.group(2) != "":
+            # a comment closed by a newline: the newline is counted
+            # but not compiled, so it continues the logical line
+            _NLINE += 1
     compile_words(0)
     _NLINE = 0
 
 
 # Code execution
 
-_IP = -1    # index in _CSTK of the next instruction to execute
-
 def execute():
-    """Execute the content of _CSTK that contains 2n elements,
-    where at even indexes we have routines and at odd indexes
-    their arguments."""
-    global _IP
-    _IP = 0
-    while _IP < len(_CSTK):
-        _IP += 2
-        _CSTK[_IP-2](_CSTK[_IP-1])
-    _IP = -1
+    """Execute the code in _vm.cstk, a _Code holding small integer
+    opcodes and their arguments. The hottest opcodes
+    are expanded inline in the dispatch loop, so they run inside
+    execute()'s own frame with the code, the instruction pointer and
+    the data stack all in local variables; the remaining ones are
+    dispatched through the _SLOW table of primitive routines. Opcodes
+    that change the control flow must stay inline: the loop assumes a
+    _SLOW routine never touches vm.ip nor vm.cstk."""
+    vm = _vm
+    ds = vm.ds
+    vnum = vm.vnum
+    vobj = vm.vobj
+    vtag = vm.vtag
+    rstk = vm.rstk
+    slow = _SLOW
+    code = vm.cstk
+    ops = code.ops
+    cargs = code.args
+    ip = 0
+    vm.ip = 0
+    n = len(ops)
+    while ip < n:
+        op = ops[ip]
+        v = cargs[ip]
+        ip += 1
+        if op == OP_PUSH:
+            p = vm.dsp
+            if p >= _DS_SIZE:
+                vm.ip = ip; overflow()
+            ds[p] = v
+            vm.dsp = p + 1
+        elif op == OP_VPUSH:
+            p = vm.dsp
+            if p >= _DS_SIZE:
+                vm.ip = ip; overflow()
+            ds[p] = vnum[v] if vtag[v] == 0 else vobj[v]
+            vm.dsp = p + 1
+        elif op == OP_VADDK:
+            a, k = v
+            p = vm.dsp
+            if p >= _DS_SIZE:
+                vm.ip = ip; overflow()
+            ds[p] = (vnum[a] if vtag[a] == 0 else vobj[a]) + k
+            vm.dsp = p + 1
+        elif op == OP_VSUBK:
+            a, k = v
+            p = vm.dsp
+            if p >= _DS_SIZE:
+                vm.ip = ip; overflow()
+            ds[p] = (vnum[a] if vtag[a] == 0 else vobj[a]) - k
+            vm.dsp = p + 1
+        elif op == OP_VLTK:
+            a, k = v
+            p = vm.dsp
+            if p >= _DS_SIZE:
+                vm.ip = ip; overflow()
+            x = vnum[a] if vtag[a] == 0 else vobj[a]
+            ds[p] = 1.0 if x < k else 0.0
+            vm.dsp = p + 1
+        elif op == OP_VADD:
+            a, b = v
+            p = vm.dsp
+            if p >= _DS_SIZE:
+                vm.ip = ip; overflow()
+            ds[p] = ((vnum[a] if vtag[a] == 0 else vobj[a])
+                     + (vnum[b] if vtag[b] == 0 else vobj[b]))
+            vm.dsp = p + 1
+        elif op == OP_ADD:
+            p = vm.dsp
+            if p < 2:
+                vm.ip = ip; underflow()
+            ds[p-2] = ds[p-2] + ds[p-1]
+            vm.dsp = p - 1
+        elif op == OP_SUB:
+            p = vm.dsp
+            if p < 2:
+                vm.ip = ip; underflow()
+            ds[p-2] = ds[p-2] - ds[p-1]
+            vm.dsp = p - 1
+        elif op == OP_MUL:
+            p = vm.dsp
+            if p < 2:
+                vm.ip = ip; underflow()
+            ds[p-2] = ds[p-2] * ds[p-1]
+            vm.dsp = p - 1
+        elif op == OP_LT:
+            p = vm.dsp
+            if p < 2:
+                vm.ip = ip; underflow()
+            ds[p-2] = 1.0 if ds[p-2] < ds[p-1] else 0.0
+            vm.dsp = p - 1
+        elif op == OP_GT:
+            p = vm.dsp
+            if p < 2:
+                vm.ip = ip; underflow()
+            ds[p-2] = 1.0 if ds[p-2] > ds[p-1] else 0.0
+            vm.dsp = p - 1
+        elif op == OP_JPZ:
+            p = vm.dsp
+            if p < 1:
+                vm.ip = ip; underflow()
+            vm.dsp = p - 1
+            if ds[p-1] == 0:
+                if v < 0:
+                    vm.ip = ip
+                    fatal("Jump to an unresolved address")
+                ip = v
+        elif op == OP_JP:
+            if v < 0:
+                vm.ip = ip
+                fatal("Jump to an unresolved address")
+            ip = v
+        elif op == OP_VSTORE:
+            p = vm.dsp
+            if p < 1:
+                vm.ip = ip; underflow()
+            vm.dsp = p - 1
+            x = ds[p-1]
+            if type(x) is float:
+                vtag[v] = 0
+                vnum[v] = x
+            else:
+                vtag[v] = 1
+                vobj[v] = x
+        elif op == OP_VINCR:
+            if vtag[v] == 0:
+                vnum[v] += 1
+            else:
+                vobj[v] += 1
+        elif op == OP_CALL:
+            rstk.append(code)
+            rstk.append(ip)
+            vm.cstk = code = v
+            ops = code.ops
+            cargs = code.args
+            ip = 0
+            n = len(ops)
+        elif op == OP_RET:
+            if len(rstk) < 2:
+                vm.ip = ip; underflow()
+            ip = rstk.pop()
+            vm.cstk = code = rstk.pop()
+            ops = code.ops
+            cargs = code.args
+            n = len(ops)
+        else:
+            vm.ip = ip
+            slow[op](vm, v)
 
 #       Run time stuff
 
-# Primitive subroutines
-def POP(): return pop(_DSTK)
-def PUSH(v): push(_DSTK, v)
-def JP(v):
-    global _IP
-    _IP = v
-def JPZ(v):
-    global _IP
-    if POP() == 0:
-        _IP = v
-def CALL(v):
-    global _IP, _CSTK
-    push(_VSTK, _CSTK)
-    push(_VSTK, _IP)
-    _CSTK = v
-    _IP = 0
+# Primitive subroutines: each one is invoked as r(vm, v) where vm is
+# the _VM instance and v the compiled argument. The hottest ones are
+# also expanded inline in execute(): the definitions below back the
+# _SLOW dispatch table and serve as the reference semantics.
+def POP(vm):
+    p = vm.dsp
+    if p == 0:
+        underflow()
+    vm.dsp = p - 1
+    return vm.ds[p - 1]
+def PUSH(vm, v):
+    p = vm.dsp
+    if p >= _DS_SIZE:
+        overflow()
+    vm.ds[p] = v
+    vm.dsp = p + 1
+def JP(vm, v):
+    vm.ip = v
+def JPZ(vm, v):
+    p = vm.dsp
+    if p == 0:
+        underflow()
+    vm.dsp = p - 1
+    if vm.ds[p - 1] == 0:
+        vm.ip = v
+def CALL(vm, v):
+    push(vm.rstk, vm.cstk)
+    push(vm.rstk, vm.ip)
+    vm.cstk = v
+    vm.ip = 0
 def CMD(v):
-    # same as CALL but invoked at compile time, therefore _IP == -1
-    # and _CSTK is under processing; therefore we save only _CSTK with
-    # a fake _IP == len(_CSTK) so that RET will set _IP to len(_CSTK)
-    # and execute() will terminate nicely.
-    global _IP, _CSTK
-    temp = _CSTK
-    push(_VSTK, v)
-    push(_VSTK, len(v))
-    _CSTK = v
+    # same as CALL but invoked at compile time, therefore _vm.ip == -1
+    # and _CSTK is under processing; therefore we run v directly with
+    # a fake return address == len(v) so that the final RET will set
+    # _vm.ip past the end of v and execute() will terminate nicely.
+    push(_vm.rstk, v)
+    push(_vm.rstk, len(v))
+    _vm.cstk = v
     execute()
-    _CSTK = temp
-    _IP = -1
-def RET(v):
-    global _IP, _CSTK
-    _IP = pop(_VSTK)
-    _CSTK = pop(_VSTK)
-def VPUSH(v): push(_DSTK, _VSTK[v])
-def VSTORE(v):
-    global _VSTK
-    _VSTK[v] = POP()
-def VINCR(v):
-    global _VSTK
-    _VSTK[v] += 1
-def VDECR(v):
-    global _VSTK
-    _VSTK[v] -= 1
-def IPUSH(v):
-    # expect _DSTK = [ ... s i ] where s is the stack and
+    _vm.ip = -1
+def RET(vm, v):
+    vm.ip = pop(vm.rstk)
+    vm.cstk = pop(vm.rstk)
+def VPUSH(vm, v):
+    p = vm.dsp
+    if p >= _DS_SIZE:
+        overflow()
+    vm.ds[p] = vm.vnum[v] if vm.vtag[v] == 0 else vm.vobj[v]
+    vm.dsp = p + 1
+def VSTORE(vm, v):
+    x = POP(vm)
+    if type(x) is float:
+        vm.vtag[v] = 0
+        vm.vnum[v] = x
+    else:
+        vm.vtag[v] = 1
+        vm.vobj[v] = x
+def VINCR(vm, v):
+    if vm.vtag[v] == 0:
+        vm.vnum[v] += 1
+    else:
+        vm.vobj[v] += 1
+def VDECR(vm, v):
+    if vm.vtag[v] == 0:
+        vm.vnum[v] -= 1
+    else:
+        vm.vobj[v] -= 1
+def IPUSH(vm, v):
+    # expect vm.dstk = [ ... s i ] where s is the stack and
     # i the index of the element to retrieve: both are
     # removed and s[i] is pushed instead.
-    i = int(POP())
-    s = POP()
-    exit_on(i < -len(s) or i >= len(s), "Index out of range")
-    PUSH(s[i])
-def ISTORE(v):
-    global _VSTK
-    # expect _DSTK = [ ... i e ] where i is the index of the
-    # element of the stack _VSTK[v] to modify and e the value
+    i = int(POP(vm))
+    s = POP(vm)
+    if i < -len(s) or i >= len(s):
+        fatal("Index out of range")
+    PUSH(vm, s[i])
+def ISTORE(vm, v):
+    # expect vm.dstk = [ ... i e ] where i is the index of the
+    # element of the stack vm.vobj[v] to modify and e the value
     # to write at it.
-    e = POP()
-    i = int(POP())
-    exit_on(i < -len(_VSTK[v]) or i >= len(_VSTK[v]), "Index out of range")
-    _VSTK[v][i] = e
+    e = POP(vm)
+    i = int(POP(vm))
+    s = vm.vobj[v]
+    if i < -len(s) or i >= len(s):
+        fatal("Index out of range")
+    s[i] = e
 
 # Implementation of built-in words
 
-def ABS(v): PUSH(abs(POP()))
-def ADD(v): PUSH(POP() + POP())
-def DIV(v): PUSH((1.0 / POP()) * POP())
-def MUL(v): PUSH(POP() * POP())
-def NEG(v): PUSH(-POP())
-def POW(v):
-    e = POP()
-    PUSH(POP() ** e)
-def RAND(v): PUSH(random.random())
-def ROUND(v): PUSH(round(POP()))
-def SUB(v): PUSH(-POP() + POP())
+# The numeric primitives rewrite the topmost stack slots in place,
+# binding ds and dsp to locals: no POP/PUSH call, no pop/append.
+
+def ABS(vm, v):
+    s = vm.ds; p = vm.dsp
+    if p < 1:
+        underflow()
+    s[p-1] = abs(s[p-1])
+def ADD(vm, v):
+    s = vm.ds; p = vm.dsp
+    if p < 2:
+        underflow()
+    s[p-2] = s[p-2] + s[p-1]
+    vm.dsp = p - 1
+def DIV(vm, v):
+    s = vm.ds; p = vm.dsp
+    if p < 2:
+        underflow()
+    s[p-2] = s[p-2] / s[p-1]
+    vm.dsp = p - 1
+def MUL(vm, v):
+    s = vm.ds; p = vm.dsp
+    if p < 2:
+        underflow()
+    s[p-2] = s[p-2] * s[p-1]
+    vm.dsp = p - 1
+def NEG(vm, v):
+    s = vm.ds; p = vm.dsp
+    if p < 1:
+        underflow()
+    s[p-1] = -s[p-1]
+def POW(vm, v):
+    s = vm.ds; p = vm.dsp
+    if p < 2:
+        underflow()
+    s[p-2] = s[p-2] ** s[p-1]
+    vm.dsp = p - 1
+def RAND(vm, v): PUSH(vm, random.random())
+def ROUND(vm, v):
+    s = vm.ds; p = vm.dsp
+    if p < 1:
+        underflow()
+    s[p-1] = round(s[p-1])
+def SUB(vm, v):
+    s = vm.ds; p = vm.dsp
+    if p < 2:
+        underflow()
+    s[p-2] = s[p-2] - s[p-1]
+    vm.dsp = p - 1
 
 # Notice: we want a Boolean to be a number
-def EQ(v): PUSH(float(POP() == POP()))
-def GEQ(v): PUSH(float(POP() <= POP()))
-def GT(v): PUSH(float(POP() < POP()))
-def LEQ(v): PUSH(float(POP() >= POP()))
-def LT(v): PUSH(float(POP() > POP()))
-def NEQ(v): PUSH(float(POP() != POP()))
+def EQ(vm, v):
+    s = vm.ds; p = vm.dsp
+    if p < 2:
+        underflow()
+    s[p-2] = 1.0 if s[p-2] == s[p-1] else 0.0
+    vm.dsp = p - 1
+def GEQ(vm, v):
+    s = vm.ds; p = vm.dsp
+    if p < 2:
+        underflow()
+    s[p-2] = 1.0 if s[p-2] >= s[p-1] else 0.0
+    vm.dsp = p - 1
+def GT(vm, v):
+    s = vm.ds; p = vm.dsp
+    if p < 2:
+        underflow()
+    s[p-2] = 1.0 if s[p-2] > s[p-1] else 0.0
+    vm.dsp = p - 1
+def LEQ(vm, v):
+    s = vm.ds; p = vm.dsp
+    if p < 2:
+        underflow()
+    s[p-2] = 1.0 if s[p-2] <= s[p-1] else 0.0
+    vm.dsp = p - 1
+def LT(vm, v):
+    s = vm.ds; p = vm.dsp
+    if p < 2:
+        underflow()
+    s[p-2] = 1.0 if s[p-2] < s[p-1] else 0.0
+    vm.dsp = p - 1
+def NEQ(vm, v):
+    s = vm.ds; p = vm.dsp
+    if p < 2:
+        underflow()
+    s[p-2] = 1.0 if s[p-2] != s[p-1] else 0.0
+    vm.dsp = p - 1
+
+def AND(vm, v):
+    s = vm.ds; p = vm.dsp
+    if p < 2:
+        underflow()
+    s[p-2] = 1.0 if s[p-2] != 0 and s[p-1] != 0 else 0.0
+    vm.dsp = p - 1
+def NOT(vm, v):
+    s = vm.ds; p = vm.dsp
+    if p < 1:
+        underflow()
+    s[p-1] = 1.0 if s[p-1] == 0 else 0.0
+def OR(vm, v):
+    s = vm.ds; p = vm.dsp
+    if p < 2:
+        underflow()
+    s[p-2] = 1.0 if s[p-2] != 0 or s[p-1] != 0 else 0.0
+    vm.dsp = p - 1
+
+# Superinstructions: the peephole pass below fuses the most frequent
+# compiled triples into a single primitive, cutting two dispatches per
+# occurrence. They push the result directly, with ds/dsp in locals.
+
+def VADDK(vm, v):   # VPUSH a; PUSH k; ADD
+    a, k = v
+    p = vm.dsp
+    if p >= _DS_SIZE:
+        overflow()
+    vm.ds[p] = (vm.vnum[a] if vm.vtag[a] == 0 else vm.vobj[a]) + k
+    vm.dsp = p + 1
+def VSUBK(vm, v):   # VPUSH a; PUSH k; SUB
+    a, k = v
+    p = vm.dsp
+    if p >= _DS_SIZE:
+        overflow()
+    vm.ds[p] = (vm.vnum[a] if vm.vtag[a] == 0 else vm.vobj[a]) - k
+    vm.dsp = p + 1
+def VLTK(vm, v):    # VPUSH a; PUSH k; LT (the FOR-loop condition)
+    a, k = v
+    p = vm.dsp
+    if p >= _DS_SIZE:
+        overflow()
+    x = vm.vnum[a] if vm.vtag[a] == 0 else vm.vobj[a]
+    vm.ds[p] = 1.0 if x < k else 0.0
+    vm.dsp = p + 1
+def VADD(vm, v):    # VPUSH a; VPUSH b; ADD
+    a, b = v
+    p = vm.dsp
+    if p >= _DS_SIZE:
+        overflow()
+    vm.ds[p] = ((vm.vnum[a] if vm.vtag[a] == 0 else vm.vobj[a])
+                + (vm.vnum[b] if vm.vtag[b] == 0 else vm.vobj[b]))
+    vm.dsp = p + 1
+
+# (VPUSH,a)(PUSH,k)(op) triples fused by the opcode op they end with.
+_FUSED_K = {}   # filled once the opcodes are defined
 
-def AND(v): PUSH(float(POP() != 0 and POP() != 0))
-def NOT(v): PUSH(float(POP() == 0))
-def OR(v): PUSH(float(POP() != 0 or POP() != 0))
+def peephole(code):
+    """Fuse recognized instruction triples of code into single
+    superinstructions, rebuilding it in place and remapping jump
+    targets. Compilation is one-shot, so the pass cost is negligible
+    next to the dispatches it saves at run time."""
+    ops = code.ops
+    args = code.args
+    n = len(ops)
+    # collect jump targets: a triple is fused only if no jump lands
+    # in the middle of it.
+    targets = set()
+    for r, v in zip(ops, args):
+        if r == OP_JP or r == OP_JPZ:
+            targets.add(v)
+    new_ops = []
+    new_args = []
+    addr_map = [0] * (n + 1)    # old address -> new address
+    i = 0
+    while i < n:
+        addr_map[i] = len(new_ops)
+        r = ops[i]
+        if (r == OP_VPUSH and i + 2 < n
+                and i + 1 not in targets and i + 2 not in targets):
+            r1 = ops[i + 1]
+            r2 = ops[i + 2]
+            if r1 == OP_PUSH and (fused := _FUSED_K.get(r2)) is not None:
+                new_ops.append(fused)
+                new_args.append((args[i], args[i + 1]))
+                i += 3
+                continue
+            if r1 == OP_VPUSH and r2 == OP_ADD:
+                new_ops.append(OP_VADD)
+                new_args.append((args[i], args[i + 1]))
+                i += 3
+                continue
+        new_ops.append(r)
+        new_args.append(args[i])
+        i += 1
+    addr_map[n] = len(new_ops)
+    for j, r in enumerate(new_ops):
+        if r == OP_JP or r == OP_JPZ:
+            new_args[j] = addr_map[new_args[j]]
+    # rebuild in place: dictionary entries keep referencing this code
+    ops[:] = array("h", new_ops)
+    args[:] = new_args
+
+# Open parentheses are tracked on a side stack of (closer, base)
+# pairs, where base is the _DSTK depth at the opening bracket: no
+# marker triple lands on _DSTK and the matching is O(1).
+_PAREN_STK = []
 
 def open_par(r):
-    """Push on the stack a marker r that close_par will pop; the marker
-    is stored as a triple so to be handles as operators are by the
-    compile_*() functions. """
-    PUSH(None)
-    PUSH(r)
-    PUSH(0)
+    """Record the closer r that close_par will match, together with
+    the current _DSTK depth that fences compile_words."""
+    _PAREN_STK.append((r, len(_DSTK)))
 def close_par(m):
-    """Compile words from _DSTK into _CSTK until the marker m is found."""
-    while len(_DSTK) >= 3:
-        p = pop(_DSTK)
-        r = pop(_DSTK)
-        v = pop(_DSTK)
-        if m == r:
-            return
-        push(_CSTK, r)
-        push(_CSTK, v)
-    error_on(True, f"Unmatched parenthesis '{m}'")
-
-def STRCONST(v):
-    # Scans each character from the next until another double quote
-    # is scanned, or the file is ended.
-    s = ""
-    while (c := scan_char()) != "\"":
-        exit_on(c == "", "End of file inside string")
-        s += c
-    compile(255, PUSH, s)
-
-def COMMENT(v):
-    global _NLINE
-    # Skip until the next '\n' which is skipped, too
-    while (c := scan_char()) != '' and c != '\n':
-        pass
-    if c == '\n':
-        _NLINE += 1
+    """Compile the words pending on _DSTK above the innermost open
+    parenthesis, which must be closed by m."""
+    if not _PAREN_STK or _PAREN_STK[-1][0] != m:
+        compile_error(f"Unmatched parenthesis '{m}'")
+        return
+    base = _PAREN_STK.pop()[1]
+    d = _DSTK
+    ops = _CSTK.ops
+    args = _CSTK.args
+    while len(d) > base:
+        p = d.pop()
+        r = d.pop()
+        v = d.pop()
+        ops.append(r)
+        args.append(v)
+
 def NEWLINE(v):
     global _NLINE
     compile_words(1)
     _NLINE += 1
 
-def PRINT(v): print(POP())
+def PRINT(vm, v): print(POP(vm))
 
 def insert_word(p, r, v):
     """Scan a word from _SRC and insert it into the dictionary with
@@ -299,302 +745,554 @@ def insert_word(p, r, v):
     create a dictionary entry."""
     compile_words(1)    # compile everything before definition
     w = scan_word()
-    #error_on(find_word(w) >= 0, f"Word {w} already defined")
-    push(_DICT, w)
-    push(_DICT, p)
-    push(_DICT, r)
-    push(_DICT, v)
+    #if find_word(w) is not None:
+    #    compile_error(f"Word {w} already defined")
+    _USER[w] = (p, r, v)
+    _RESOLVED.clear()
 
 def DEF(v):     # DEF word = ...
-    # Allocate a new item on _VSTK to contain the value of the variable
-    # and store the "address" of the item (i.e. its index in _VSTK) as
-    # value of the word under definition
-    i = len(_VSTK)      # index of the item to allocate
-    push(_VSTK, 0.0)    # allocate item
-    insert_word(255, VPUSH, i)
-    error_on(scan_word() != "=", "'=' expected")
+    # Allocate a new variable slot (numeric at first) and store its
+    # "address" (i.e. its index in the variable arrays) as value of
+    # the word under definition
+    i = len(_VTAG)      # index of the slot to allocate
+    _VNUM.append(0.0)   # allocate the slot on all three sides
+    _VOBJ.append(None)
+    _VTAG.append(0)
+    insert_word(255, OP_VPUSH, i)
+    if scan_word() != "=":
+        compile_error("'=' expected")
     # compile the assignment with priority 50, thus later than any
     # expression producing a value but earlier then instructions.
-    compile(50, VSTORE, i)
+    compile(50, OP_VSTORE, i)
 
 def compile_assignment(r):  # LET w = ... | ... OF w = ...
     """Scan a word from _SRC, look for it inside the dictionary and check
-    that its routine is VPUSH, check that it is followed by "=" and compile
+    that its routine is OP_VPUSH, check that it is followed by "=" and compile
     it with priority 50 (so that it'll be compiled later than any expression)
-    and routine r (VSTORE, ISTORE, etc.). The index in _DICT of the variable
-    or, if not found, a negative value is returned."""
+    and routine r (VSTORE, ISTORE, etc.). The dictionary triple (p,r,v) of
+    the variable or, if not found, None is returned."""
     w = scan_word()
-    i = find_word(w)
-    if i < 0 or _DICT[i + 2] != VPUSH:
-        error_on(True, f"Unknown variable {w}")
+    t = find_word(w)
+    if t is None or t[1] != OP_VPUSH:
+        compile_error(f"Unknown variable {w}")
     else:
-        error_on(scan_word() != "=", "'=' expected")
-        compile(50, r, _DICT[i+3])
-    return i
+        if scan_word() != "=":
+            compile_error("'=' expected")
+        compile(50, r, t[2])
+    return t
 
 def STACK(v):     # STACK word
-    i = len(_VSTK)      # index of the item to allocate
-    push(_VSTK, [])     # allocate empty stack
-    insert_word(255, VPUSH, i)
-def SPUSH(v):   # PUSH(s v)
-    v = POP()
-    s = POP()
+    i = len(_VTAG)      # index of the slot to allocate
+    _VNUM.append(0.0)
+    _VOBJ.append([])    # allocate empty stack
+    _VTAG.append(1)
+    insert_word(255, OP_VPUSH, i)
+def SPUSH(vm, v):   # PUSH(s v)
+    v = POP(vm)
+    s = POP(vm)
     push(s, v)
-def SPOP(v):   # POP(s)
-    s = POP()
-    PUSH(pop(s))
-def STOS(v):   # TOS(s)
-    s = POP()
-    exit_on(len(s) == 0, "Missing data (stack underflow)")
-    PUSH(s[-1])
-def SLEN(v):    # LEN(s)
-    s = POP()
-    PUSH(len(s))
+def SPOP(vm, v):   # POP(s)
+    s = POP(vm)
+    PUSH(vm, pop(s))
+def STOS(vm, v):   # TOS(s)
+    s = POP(vm)
+    if len(s) == 0:
+        fatal("Missing data (stack underflow)")
+    PUSH(vm, s[-1])
+def SLEN(vm, v):    # LEN(s)
+    s = POP(vm)
+    PUSH(vm, len(s))
 def CLOSEBRA(r):
     close_par(r)
     # At runtime expect _DSTK = [ ... s i] and returns s[i]
-    compile(255, IPUSH, None)
+    compile(255, OP_IPUSH, None)
 
 def BEGIN(p):   # BEGIN word ... END
     # parameter p is the priority of the new word
-    global _CSTK, _DICT
+    global _CSTK, _USER
     # Inserts a new definition in the dictionary and leaves the _PSTK
-    # as: [ ... c d BEGIN] where d is the current limit of _DICT and
-    # c is a reference to the current _CSTK. d is used to "undefine" all
-    # definition defined inside the block, while c is used to restore
-    # the stack where to compile the code surrounding the block.
+    # as: [ ... (c, BEGIN)] where c is a reference to the current
+    # _CSTK, used to restore the stack where to compile the code
+    # surrounding the block. The current user dictionary is saved on
+    # _USER_STACK and compilation goes on in a copy, so that END
+    # "undefines" every definition local to the block with a single
+    # swap back.
     # The value of the new definition is the address of the block code
-    # which will be compiled until the next END word. So we save _CSTK,
-    # define a new empty _CSTK pointed by the new word and save also
-    # a sentinel BEGIN expected by END
-    push(_PSTK, _CSTK)
-    _CSTK = []          # now code will be compiled here
-    insert_word(p, CMD if p == 0 else CALL, _CSTK)
-    push(_PSTK, len(_DICT))
-    push(_PSTK, BEGIN)  # END expects this
+    # which will be compiled until the next END word. So we save _CSTK
+    # along with the sentinel BEGIN expected by END and define a new
+    # empty _CSTK pointed by the new word
+    push(_PSTK, (_CSTK, BEGIN))
+    _CSTK = _Code()     # now code will be compiled here
+    insert_word(p, CMD if p == 0 else OP_CALL, _CSTK)
+    _USER_STACK.append(_USER)
+    _USER = dict(_USER)     # definitions from now on are local
 def END(v):
-    global _CSTK, _DICT
+    global _CSTK, _USER
     compile_words(1)    # to be sure anything before END is compiled
-    error_on(pop(_PSTK) != BEGIN, "'END' without 'BEGIN'")
-    compile(255, RET, 0)
-    # deletes all definitions local to the ending one.
-    d = pop(_PSTK)  # len(_DICT) when BEGIN was executed
-    while len(_DICT) > d:
-        # drop the last four entries on top of _DICT
-        _DICT.pop()
-        _DICT.pop()
-        _DICT.pop()
-        _DICT.pop()
-    _CSTK = pop(_PSTK)
+    c, m = pop(_PSTK)
+    if m != BEGIN:
+        compile_error("'END' without 'BEGIN'")
+        return
+    compile(255, OP_RET, 0)
+    if _ERRNO == 0:
+        peephole(_CSTK)     # the block is complete: fuse its code
+    # deletes all definitions local to the ending one, restoring
+    # possibly shadowed outer ones.
+    _USER = _USER_STACK.pop()
+    _RESOLVED.clear()
+    _CSTK = c
 
 def IF(v):   # IF ... THEN ... ELIF ... THEN ... ... ELSE ... FI
     compile_words(1)    # compile almost everything before IF
-    push(_PSTK, FI)     # FI expects this: above this ELIF will
-                        # insert addresses unrolled by FI
-    push(_PSTK, IF)     # THEN expects this
+    push(_PSTK, (None, FI))     # FI expects this: above this ELIF
+                                # leaves addresses unrolled by FI
+    push(_PSTK, (None, IF))     # THEN expects this
 def THEN(v):
-    error_on(pop(_PSTK) != IF, "'THEN' without 'IF'")
+    if pop(_PSTK)[1] != IF:
+        compile_error("'THEN' without 'IF'")
     # Compile expressions to _CSTK and next compile JP
     compile_words(1)
-    compile(255, JPZ, 1e20) # 1e20 changed later
-    # mark where the jumping "address" will be written
-    push(_PSTK, len(_CSTK) - 1)
-    push(_PSTK, THEN)   # ELSE and FI expect this
+    compile(255, OP_JPZ, -1)    # -1 = back-patched later
+    # mark where the jumping "address" will be written:
+    # ELSE and FI expect this
+    push(_PSTK, (len(_CSTK) - 1, THEN))
 def ELIF(v):
     ELSE(v)
-    pop(_PSTK)
-    push(_PSTK, IF)     # THEN expects this
+    push(_PSTK, (None, IF))     # THEN expects this
 def ELSE(v):
-    error_on(pop(_PSTK) != THEN, "'ELSE' without 'THEN'")
+    i, m = pop(_PSTK)   # i = index where to write a jump address
+    if m != THEN:
+        compile_error("'ELSE' without 'THEN'")
+        return
     # Compile expressions to _CSTK and next compile JP
     compile_words(1)
-    compile(255, JP, 1e20)  # 1e20 changed later
-    i = pop(_PSTK)          # index where to write a jump address
+    compile(255, OP_JP, -1)     # -1 = back-patched later
     # mark where the jumping "address" will be written
     j = len(_CSTK) - 1
-    push(_PSTK, j)
-    _CSTK[i] = j + 1    # The JPZ compiled by THEN jumps here
-    push(_PSTK, ELSE)   # FI expects this
+    push(_PSTK, (j, ELSE))      # FI expects this
+    _CSTK.args[i] = j + 1   # The JPZ compiled by THEN jumps here
 def FI(v):
-    m = pop(_PSTK)
-    error_on(m != THEN and m != ELSE, "'FI' without 'THEN'/'ELSE'")
+    i, m = pop(_PSTK)
+    if m != THEN and m != ELSE:
+        compile_error("'FI' without 'THEN'/'ELSE'")
+        return
     # A list of addresses where to write a pointer to the next
-    # compiled instruction are written above FI in _PSTACK: they
-    # are n + 1, being n the number of ELIFs
+    # compiled instruction lies above FI in _PSTK: they are n + 1,
+    # being n the number of ELIFs
     compile_words(1)
-    while (i := pop(_PSTK)) != FI:
-        _CSTK[i] = len(_CSTK)
+    while m != FI:
+        _CSTK.args[i] = len(_CSTK)
+        i, m = pop(_PSTK)
+        if m != FI and m != THEN and m != ELSE:
+            # a foreign record: the IF was closed around another
+            # construct, give up on this one
+            compile_error("'FI' without 'THEN'/'ELSE'")
+            return
 
 def WHILE(v):   # WHILE ... DO ... OD
     compile_words(1)    # compile almost everything before WHILE
-    # mark where to jump to repeat the loop
-    push(_PSTK, len(_CSTK))
-    push(_PSTK, WHILE)  # DO expects this
+    # mark where to jump to repeat the loop: DO expects this
+    push(_PSTK, (len(_CSTK), WHILE))
 def DO(v):
-    m = pop(_PSTK)
-    error_on(m != WHILE and m != FOR, "'DO' without 'WHILE' or 'FOR'")
+    a, m = pop(_PSTK)
+    if m != WHILE and m != FOR:
+        compile_error("'DO' without 'WHILE' or 'FOR'")
     # Compile expressions to _CSTK and next compile JP
     compile_words(1)
-    compile(255, JPZ, 1e20) # changed later
-    # mark where the jumping "address" will be written
-    push(_PSTK, len(_CSTK) - 1)
-    push(_PSTK, DO)   # OD expects this
+    compile(255, OP_JPZ, -1)    # -1 = back-patched later
+    # mark where the jumping "address" will be written, along with
+    # the opening word and its payload: OD and NEXT expect this and
+    # check that the loop was opened by the right word
+    push(_PSTK, ((m, a, len(_CSTK) - 1), DO))
 def OD(v):
-    error_on(pop(_PSTK) != DO, "'OD' without 'DO'")
-    # now _PSTK = [..., a, b] where a is the address of the while
-    # condition and b is the address of the argument of the JPZ
-    # compiled by OD: in the latter we need to write the address
-    # of the first item following the loop, the former will be the
-    # argument of the JP compiled by OD to repeat the loop.
-    b = pop(_PSTK)
-    a = pop(_PSTK)
+    p, m = pop(_PSTK)
+    if m != DO:
+        compile_error("'OD' without 'DO'")
+        return
+    # p = (o, a, b) where o is the word that opened the loop, a the
+    # address of the while condition and b the address of the
+    # argument of the JPZ compiled by DO: in the latter we need to
+    # write the address of the first item following the loop, the
+    # former will be the argument of the JP compiled by OD to repeat
+    # the loop.
+    o, a, b = p
+    if o != WHILE:
+        compile_error("'OD' without 'WHILE'")
+        return
     compile_words(5)
-    compile(255, JP, a)
-    _CSTK[b] = len(_CSTK)
+    compile(255, OP_JP, a)
+    _CSTK.args[b] = len(_CSTK)
 
 def FOR(v):     # FOR w = e1 TO e2 DO ... NEXT
     DEF(0)
-    push(_PSTK, _DICT[-1]) # index of the control variable, needed later
-    push(_PSTK, FOR)        # TO expects this
+    # DEF just allocated the control variable in the last slot: its
+    # index is needed later by TO.
+    push(_PSTK, (len(_VTAG) - 1, FOR))
 def TO(v):      # TO expr DO
     compile_words(1)
     j = len(_CSTK)      # keep track of the location of the "TO condition"
                         # so that NEXT will jump here to repeat the loop
-    error_on(pop(_PSTK) != FOR, "'TO' without 'FOR'")
+    i, m = pop(_PSTK)   # i = loop variable slot index
+    if m != FOR:
+        compile_error("'TO' without 'FOR'")
     # compile the condition "loopvar < expr"
-    i = pop(_PSTK)      # loop variable index in _VSTK
-    compile(255, VPUSH, i)
-    compile(50, LT, None)
-    push(_PSTK, j)
-    push(_PSTK, i)
-    push(_PSTK, FOR)
+    compile(255, OP_VPUSH, i)
+    compile(50, OP_LT, None)
+    push(_PSTK, ((j, i), FOR))
 def NEXT(v):
     global _CSTK
-    # expect _PSTK = [ ... j i b FOR ] where j is the address
-    # where the NEXT will jump to iterate the loop, i is the index
-    # in _VSTK of the loop control variable, b is the address
+    # expect _PSTK = [ ... ((FOR, (j, i), b), DO) ] where j is the
+    # address where the NEXT will jump to iterate the loop, i is the
+    # slot index of the loop control variable, b is the address
     # of the argument of the JPZ compiled by DO where the address
     # of the first instruction following the loop needs to be stored.
-    error_on(pop(_PSTK) != DO, "'NEXT' without 'DO'")
-    b = pop(_PSTK)
-    i = pop(_PSTK)
-    j = pop(_PSTK)
+    p, m = pop(_PSTK)
+    if m != DO:
+        compile_error("'NEXT' without 'DO'")
+        return
+    o, ji, b = p
+    if o != FOR:
+        compile_error("'NEXT' without 'FOR'")
+        return
+    j, i = ji
     # compile the increment of the loop variable
-    compile(255, VINCR, i)
+    compile(255, OP_VINCR, i)
     # compile a jump to the condition compiled by TO
-    compile(255, JP, j)
+    compile(255, OP_JP, j)
     # compile the address of the next instruction at b
-    _CSTK[b] = len(_CSTK)
+    _CSTK.args[b] = len(_CSTK)
 
-def FOPEN(v):       # FOPEN(...)
-    # Expect _DSTK = [ ... name mode ]: opens a file with that name and
+class _FH:
+    # Read handle returned by FOPEN: the whole file is slurped once
+    # at open time and FGET consumes the buffer by indexing, with no
+    # per-character read calls. At end of buffer FGET keeps returning
+    # the empty string, just as f.read(1) would.
+    __slots__ = ("buf", "pos")
+    def __init__(self, f):
+        self.buf = f.read()
+        self.pos = 0
+
+def FOPEN(vm, v):       # FOPEN(...)
+    # Expect vm.dstk = [ ... name mode ]: opens a file with that name and
     # mode and returns it on the stack. or NIL if no such file can be opened.
-    mode = POP()
-    name = POP()
-    PUSH(open(name, mode))
-def FCLOSE(v):
+    mode = POP(vm)
+    name = POP(vm)
+    if mode == "r":
+        with open(name, mode) as f:
+            PUSH(vm, _FH(f))
+    else:
+        PUSH(vm, open(name, mode))
+def FCLOSE(vm, v):
     try:
-        f = POP()
-        f.close()
+        f = POP(vm)
+        if type(f) is not _FH:  # read handles hold no OS resource
+            f.close()
     except:
-        exit_on(True, "I/O error (closing a file)")
-def FGET(v):
+        fatal("I/O error (closing a file)")
+def FGET(vm, v):
     try:
-        f = POP()
-        PUSH(f.read(1))
+        f = POP(vm)
+        p = f.pos
+        f.pos = p + 1
+        PUSH(vm, f.buf[p:p+1])
     except:
-        exit_on(True, "I/O error (reading a file)")
-def FPUT(v):
+        fatal("I/O error (reading a file)")
+def FPUT(vm, v):
     try:
-        s = POP()
-        f = POP()
+        s = POP(vm)
+        f = POP(vm)
         f.write(str(s))
     except:
-        exit_on(True, "I/O error (writing a file)")
+        fatal("I/O error (writing a file)")
 
 def INCLUDE(v):     # INCLUDE ...
     global _NAME
-    global _SRC
+    global _BUF, _TOKENS
     global _NLINE
-    push(_PSTK, _NAME)
-    push(_PSTK, _SRC)
-    push(_PSTK, _NLINE)
-    PUSH(scan_word())
-    PUSH("r")
-    FOPEN(None)
-    _SRC = POP()
+    name = scan_word()
+    push(_PSTK, (_NAME, _BUF, _TOKENS, _NLINE))
+    with open(name) as f:
+        _BUF = f.read()
     compile_file()
-    _SRC.close()
-    _NLINE = pop(_PSTK)
-    _SRC = pop(_PSTK)
-    _NAME = pop(_PSTK)
+    _NAME, _BUF, _TOKENS, _NLINE = pop(_PSTK)
+
+# Opcodes: compiled code references the primitives through small
+# integers, not function objects, so that execute() can expand the hot
+# ones inline with plain integer comparisons. _SLOW maps each opcode
+# back to its routine (the opcode is the index) and the OP_* constants
+# are defined from the same list, so the two cannot drift apart.
+
+_SLOW = [PUSH, JP, JPZ, CALL, RET, VPUSH, VSTORE, VINCR, VDECR, IPUSH,
+         ISTORE, ABS, ADD, DIV, MUL, NEG, POW, RAND, ROUND, SUB, EQ,
+         GEQ, GT, LEQ, LT, NEQ, AND, NOT, OR, PRINT, SPUSH, SPOP, STOS,
+         SLEN, FOPEN, FCLOSE, FGET, FPUT, VADDK, VSUBK, VLTK, VADD]
+
+(OP_PUSH, OP_JP, OP_JPZ, OP_CALL, OP_RET, OP_VPUSH, OP_VSTORE, OP_VINCR,
+ OP_VDECR, OP_IPUSH, OP_ISTORE, OP_ABS, OP_ADD, OP_DIV, OP_MUL, OP_NEG,
+ OP_POW, OP_RAND, OP_ROUND, OP_SUB, OP_EQ, OP_GEQ, OP_GT, OP_LEQ, OP_LT,
+ OP_NEQ, OP_AND, OP_NOT, OP_OR, OP_PRINT, OP_SPUSH, OP_SPOP, OP_STOS,
+ OP_SLEN, OP_FOPEN, OP_FCLOSE, OP_FGET, OP_FPUT, OP_VADDK, OP_VSUBK,
+ OP_VLTK, OP_VADD) = range(len(_SLOW))
+
+_FUSED_K[OP_ADD] = OP_VADDK
+_FUSED_K[OP_SUB] = OP_VSUBK
+_FUSED_K[OP_LT] = OP_VLTK
+
+# Optional JIT backend (--jit): when the program only uses numeric
+# opcodes, the whole dispatch loop can be lowered onto typed arrays and
+# compiled by numba. Both numba and numpy are imported lazily: if they
+# are missing, or the program uses anything the kernel does not lower
+# (calls, stacks, strings, files, ROUND), we silently fall back to the
+# pure-Python execute().
 
-# Dictionary stack
+# Opcodes the jitted kernel interprets on its own. PRINT and RAND are
+# also accepted: the kernel bails out on them and the Python driver
+# performs them (print formatting and the seeded random stream must
+# match the non-jitted interpreter exactly) before re-entering.
+_JIT_OPS = frozenset((
+    OP_PUSH, OP_JP, OP_JPZ, OP_VPUSH, OP_VSTORE, OP_VINCR, OP_VDECR,
+    OP_ABS, OP_ADD, OP_DIV, OP_MUL, OP_NEG, OP_POW, OP_SUB,
+    OP_EQ, OP_GEQ, OP_GT, OP_LEQ, OP_LT, OP_NEQ, OP_AND, OP_NOT, OP_OR,
+    OP_PRINT, OP_RAND, OP_VADDK, OP_VSUBK, OP_VLTK, OP_VADD))
+
+def _jit_kernel(ops, argi, argf, ds, vs, ip, dsp):
+    """The interpreter loop over typed arrays, compiled by numba when
+    --jit is given: ops holds the opcodes, argi/argf the integer and
+    float argument of each (superinstructions use both). Returns
+    (status, ip, dsp) where status 0 means done, 1 a PRINT bail-out
+    (the driver prints ds[dsp]), 2 a RAND bail-out, 3 an unresolved
+    jump and 4 an opcode the lowering should not have let through.
+    Stack bound checks are left to the compiler: lowered code is
+    machine generated and balanced by construction."""
+    n = ops.shape[0]
+    while ip < n:
+        op = ops[ip]
+        i = argi[ip]
+        f = argf[ip]
+        ip += 1
+        if op == OP_PUSH:
+            ds[dsp] = f
+            dsp += 1
+        elif op == OP_VPUSH:
+            ds[dsp] = vs[i]
+            dsp += 1
+        elif op == OP_VADDK:
+            ds[dsp] = vs[i] + f
+            dsp += 1
+        elif op == OP_VSUBK:
+            ds[dsp] = vs[i] - f
+            dsp += 1
+        elif op == OP_VLTK:
+            ds[dsp] = 1.0 if vs[i] < f else 0.0
+            dsp += 1
+        elif op == OP_VADD:
+            ds[dsp] = vs[i] + vs[int(f)]
+            dsp += 1
+        elif op == OP_ADD:
+            dsp -= 1
+            ds[dsp-1] = ds[dsp-1] + ds[dsp]
+        elif op == OP_SUB:
+            dsp -= 1
+            ds[dsp-1] = ds[dsp-1] - ds[dsp]
+        elif op == OP_MUL:
+            dsp -= 1
+            ds[dsp-1] = ds[dsp-1] * ds[dsp]
+        elif op == OP_DIV:
+            dsp -= 1
+            ds[dsp-1] = ds[dsp-1] / ds[dsp]
+        elif op == OP_POW:
+            dsp -= 1
+            ds[dsp-1] = ds[dsp-1] ** ds[dsp]
+        elif op == OP_NEG:
+            ds[dsp-1] = -ds[dsp-1]
+        elif op == OP_ABS:
+            ds[dsp-1] = abs(ds[dsp-1])
+        elif op == OP_EQ:
+            dsp -= 1
+            ds[dsp-1] = 1.0 if ds[dsp-1] == ds[dsp] else 0.0
+        elif op == OP_NEQ:
+            dsp -= 1
+            ds[dsp-1] = 1.0 if ds[dsp-1] != ds[dsp] else 0.0
+        elif op == OP_LT:
+            dsp -= 1
+            ds[dsp-1] = 1.0 if ds[dsp-1] < ds[dsp] else 0.0
+        elif op == OP_LEQ:
+            dsp -= 1
+            ds[dsp-1] = 1.0 if ds[dsp-1] <= ds[dsp] else 0.0
+        elif op == OP_GT:
+            dsp -= 1
+            ds[dsp-1] = 1.0 if ds[dsp-1] > ds[dsp] else 0.0
+        elif op == OP_GEQ:
+            dsp -= 1
+            ds[dsp-1] = 1.0 if ds[dsp-1] >= ds[dsp] else 0.0
+        elif op == OP_AND:
+            dsp -= 1
+            ds[dsp-1] = 1.0 if ds[dsp-1] != 0.0 and ds[dsp] != 0.0 else 0.0
+        elif op == OP_OR:
+            dsp -= 1
+            ds[dsp-1] = 1.0 if ds[dsp-1] != 0.0 or ds[dsp] != 0.0 else 0.0
+        elif op == OP_NOT:
+            ds[dsp-1] = 1.0 if ds[dsp-1] == 0.0 else 0.0
+        elif op == OP_JP:
+            if i < 0:
+                return 3, ip, dsp
+            ip = i
+        elif op == OP_JPZ:
+            dsp -= 1
+            if ds[dsp] == 0.0:
+                if i < 0:
+                    return 3, ip, dsp
+                ip = i
+        elif op == OP_VSTORE:
+            dsp -= 1
+            vs[i] = ds[dsp]
+        elif op == OP_VINCR:
+            vs[i] += 1.0
+        elif op == OP_VDECR:
+            vs[i] -= 1.0
+        elif op == OP_PRINT:
+            dsp -= 1
+            return 1, ip, dsp
+        elif op == OP_RAND:
+            return 2, ip, dsp
+        else:
+            return 4, ip, dsp
+    return 0, ip, dsp
+
+def execute_jit():
+    """Run the compiled program through the numba-compiled kernel and
+    return True; return False (caller falls back to execute()) if
+    numba is not installed or the program is not lowerable: every
+    opcode must be in _JIT_OPS, every PUSH argument and every variable
+    must be a float."""
+    try:
+        import numpy as np
+        from numba import njit
+    except ImportError:
+        return False
+    code = _CSTK
+    for op, v in zip(code.ops, code.args):
+        if op not in _JIT_OPS or (op == OP_PUSH and type(v) is not float):
+            return False
+    if any(_VTAG):      # some variable holds an object
+        return False
+    n = len(code)
+    ops = np.empty(n, np.int32)
+    argi = np.zeros(n, np.int64)
+    argf = np.zeros(n, np.float64)
+    for j, (op, v) in enumerate(zip(code.ops, code.args)):
+        ops[j] = op
+        if op == OP_PUSH:
+            argf[j] = v
+        elif op == OP_VADD:
+            argi[j] = v[0]
+            argf[j] = v[1]  # second variable index, cast in the kernel
+        elif type(v) is tuple:  # VADDK, VSUBK, VLTK
+            argi[j] = v[0]
+            argf[j] = v[1]
+        elif v is not None:
+            argi[j] = v
+    ds = np.zeros(_DS_SIZE, np.float64)
+    # share the buffer of the variable array: VSTOREs performed by the
+    # kernel are directly visible on the Python side
+    vs = np.frombuffer(_VNUM, np.float64) if len(_VNUM) > 0 \
+        else np.zeros(0, np.float64)
+    kernel = njit(cache=True)(_jit_kernel)
+    ip = 0
+    dsp = 0
+    while True:
+        status, ip, dsp = kernel(ops, argi, argf, ds, vs, ip, dsp)
+        if status == 0:
+            break
+        if status == 1:     # PRINT: pop and print from the driver
+            print(float(ds[dsp]))
+        elif status == 2:   # RAND: keep CPython's seeded stream
+            ds[dsp] = random.random()
+            dsp += 1
+        elif status == 3:
+            _vm.ip = ip
+            fatal("Jump to an unresolved address")
+        else:
+            _vm.ip = ip
+            fatal("JIT lowering let a non-lowered opcode through")
+    return True
+
+# Dictionary: the builtin words are listed in the flat table below as
+# quadruples (w,p,r,v); at startup they are hashed into the frozen
+# _BUILTINS map from each word to its triple (p,r,v). User definitions
+# live in the separate _USER map, the only one scoping needs to touch.
 
 _DICT = [
-    "$PRINT", 10, PRINT, None,
+    "$PRINT", 10, OP_PRINT, None,
     "(", 0, open_par, ")",
     ")", 0, close_par, ")",
-    "*", 110, MUL, None,
-    "**", 130, POW, None,
-    "+", 100, ADD, None,
-    "-", 100, SUB, None,
-    "/", 110, DIV, None,
-    "<", 90, LT, None,
-    "<=", 90, LEQ, None,
-    "<>", 90, NEQ, None,
-    "=", 90, EQ, None,
-    ">", 90, GT, None,
-    ">=", 90, GEQ, None,
-    "ABS", 200, ABS, None,
-    "AND", 70, AND, None,
+    "*", 110, OP_MUL, None,
+    "**", 130, OP_POW, None,
+    "+", 100, OP_ADD, None,
+    "-", 100, OP_SUB, None,
+    "/", 110, OP_DIV, None,
+    "<", 90, OP_LT, None,
+    "<=", 90, OP_LEQ, None,
+    "<>", 90, OP_NEQ, None,
+    "=", 90, OP_EQ, None,
+    ">", 90, OP_GT, None,
+    ">=", 90, OP_GEQ, None,
+    "ABS", 200, OP_ABS, None,
+    "AND", 70, OP_AND, None,
     "CMD", 0, BEGIN, 0,
     "DEF", 0, DEF, None,
     "DO", 0, DO, None,
     "ELIF", 0, ELIF, None,
     "ELSE", 0, ELSE, None,
     "END", 0, END, None,
-    "FCLOSE", 10, FCLOSE, None,
-    "FGET", 200, FGET, None,
+    "FCLOSE", 10, OP_FCLOSE, None,
+    "FGET", 200, OP_FGET, None,
     "FI", 0, FI, None,
-    "FOPEN", 200, FOPEN, None,
+    "FOPEN", 200, OP_FOPEN, None,
     "FOR", 0, FOR, None,
-    "FPUT", 10, FPUT, None,
+    "FPUT", 10, OP_FPUT, None,
     "FUNC", 0, BEGIN, 250,
     "IF", 0, IF, None,
     "INCLUDE", 0, INCLUDE, None,
-    "LEN", 200, SLEN, None,
-    "LET", 0, compile_assignment, VSTORE,
-    "NEG", 120, NEG, None,
+    "LEN", 200, OP_SLEN, None,
+    "LET", 0, compile_assignment, OP_VSTORE,
+    "NEG", 120, OP_NEG, None,
     "NEXT", 0, NEXT, None,
-    "NIL", 255, PUSH, None,
-    "NOT", 80, NOT, None,
+    "NIL", 255, OP_PUSH, None,
+    "NOT", 80, OP_NOT, None,
     "OD", 0, OD, None,
-    "OF", 0, compile_assignment, ISTORE,
-    "OR", 60, OR, None,
-    "POP", 200, SPOP, None,
-    "PRINT", 10, PRINT, None,
+    "OF", 0, compile_assignment, OP_ISTORE,
+    "OR", 60, OP_OR, None,
+    "POP", 200, OP_SPOP, None,
+    "PRINT", 10, OP_PRINT, None,
     "PROC", 0, BEGIN, 10,
-    "PUSH", 20, SPUSH, None,
-    "RAND", 255, RAND, None,
-    "ROUND", 200, ROUND, None,
+    "PUSH", 20, OP_SPUSH, None,
+    "RAND", 255, OP_RAND, None,
+    "ROUND", 200, OP_ROUND, None,
     "STACK", 0, STACK, None,
     "THEN", 0, THEN, None,
     "TO", 0, TO, None,
-    "TOS", 200, STOS, None,
+    "TOS", 200, OP_STOS, None,
     "WHILE", 0, WHILE, None,
     "[", 0, open_par, "]",
-    "\"", 0, STRCONST, None,
-    "\\", 0, COMMENT, None,
     "\n", 0, NEWLINE, None,
     "]", 0, CLOSEBRA, "]"
 ]
 
+_BUILTINS = {_DICT[i]: (_DICT[i+1], _DICT[i+2], _DICT[i+3])
+             for i in range(0, len(_DICT), 4)}
+
+# User definitions; BEGIN saves the current table on _USER_STACK and
+# END restores it.
+_USER = {}
+_USER_STACK = []
+
 # Main program
 
 import argparse
 parser = argparse.ArgumentParser()
 parser.add_argument("--dump-obj", action="store_true")
+parser.add_argument("--jit", action="store_true")
 parser.add_argument("--dump-dict", action="store_true")
 parser.add_argument("--dump-vars", action="store_true")
 parser.add_argument("source")
@@ -602,29 +1300,38 @@ args = parser.parse_args()
 
 _NAME = args.source
 with open(_NAME) as f:
-    _SRC = f
-    compile_file()
+    _BUF = f.read()
+compile_file()
+
+if len(_DSTK) > 0 or len(_PAREN_STK) > 0:
+    compile_error("Some error occurred (stack mess)")
+if len(_PSTK) > 0:
+    compile_error("Control structures mismatches")
+if _ERRNO == 0:
+    # fuse only well-formed code: after compile errors the jump
+    # arguments may hold arbitrary payloads
+    peephole(_CSTK)
 
 if args.dump_obj:
     print()
     print("Code dump")
-    for i in range(0, len(_CSTK), 2):
-        print(f"{i}: {_CSTK[i]} {_CSTK[i + 1]}")
+    for i, (r, v) in enumerate(zip(_CSTK.ops, _CSTK.args)):
+        print(f"{i}: {_SLOW[r].__name__} {v}")
 
 if args.dump_dict:
     print()
     print("Dictionary dump")
-    for i in range(0, len(_DICT), 4):
-        print(_DICT[i], _DICT[i+1], _DICT[i+2], _DICT[i+3])
+    for w, (p, r, v) in {**_BUILTINS, **_USER}.items():
+        print(w, p, r, v)
 
 if args.dump_vars:
     print()
     print("Variables dump")
-    for i, x in enumerate(_VSTK):
-        print(f"{i}: {x}")
+    for i in range(len(_VTAG)):
+        print(f"{i}: {_VNUM[i] if _VTAG[i] == 0 else _VOBJ[i]}")
 
-error_on(len(_DSTK) > 0, "Some error occurred (stack mess)")
-error_on(len(_PSTK) > 0, "Control structures mismatches")
 
 if _ERRNO == 0:
-    execute()
+    _vm.cstk = _CSTK
+    if not (args.jit and execute_jit()):
+        execute()